@@ -39,13 +39,33 @@ from pathlib import Path
 import re
 import os
 import json
+import time
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import yfinance as yf
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl import Workbook
+import xlsxwriter
+from xlsxwriter.exceptions import FileCreateError
+
+
+# ========= HTTP 連線 =========
+# 共用一個 Session，讓金管會下載與 LINE 推播重複使用 keep-alive 連線
+# Retry 預設只重試 GET 等冪等方法，LINE push（POST）不會被重送
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
 
 
 # ========= LINE Bot 設定 =========
@@ -83,7 +103,7 @@ def send_line_message(text: str):
     }
 
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=10)
+        resp = _SESSION.post(url, headers=headers, data=json.dumps(body), timeout=10)
         print(f"[LINE TEXT] status={resp.status_code}, body={resp.text}")
     except Exception as e:
         print(f"[LINE TEXT] 推播失敗：{e}")
@@ -116,7 +136,7 @@ def send_flex_message(flex_content: dict):
     }
 
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=10)
+        resp = _SESSION.post(url, headers=headers, data=json.dumps(body), timeout=10)
         print(f"[LINE FLEX] status={resp.status_code}, body={resp.text}")
     except Exception as e:
         print(f"[LINE FLEX] 推播失敗：{e}")
@@ -142,15 +162,13 @@ def build_daily_excel_url(date: dt.date) -> str:
 def download_and_parse_excel(url: str) -> pd.DataFrame:
     """下載 Excel，並轉成欄位乾淨的 DataFrame。"""
     print(f"[INFO] 下載：{url}")
-    resp = requests.get(url, timeout=60)
-    resp.raise_for_status()
-
-    # header=1 表示用第 2 列當欄位（第一列是大標題）
-    raw_df = pd.read_excel(io.BytesIO(resp.content), header=1)
+    content = download_with_etag(url)
 
-    # raw_df 的第 0 列其實是「真正欄位名稱」（證券代號、公司型態…）
-    # 所以再用第 0 列 rename 一次，並把那列丟掉
-    df = raw_df.rename(columns=raw_df.iloc[0]).drop(0).reset_index(drop=True)
+    # 前兩列是大標題，第 3 列才是真正欄位名稱（證券代號、公司型態…）
+    # 直接用 header=2 讀，不必先讀進來再 rename + drop 第 0 列
+    # calamine 是 Rust 寫的串流解析器，比預設 openpyxl 快且省記憶體
+    # 全部欄位當字串讀，省掉型別推斷，也保留證券代號的前導 0
+    df = pd.read_excel(io.BytesIO(content), header=2, engine="calamine", dtype=str)
 
     print("[INFO] 欄位名稱：", list(df.columns))
     return df
@@ -162,7 +180,8 @@ def filter_conv_bond(df: pd.DataFrame, company_keyword: Optional[str] = None) ->
         raise KeyError("找不到『案件類別』欄位，請檢查今日 Excel 格式是否有變化。")
 
     # 先抓出轉換公司債相關案件（含「轉換公司債」三個字即可）
-    mask_cb = df["案件類別"].astype(str).str.contains("轉換公司債", na=False)
+    # 欄位已用 dtype=str 讀入；regex=False 走純子字串比對，不經 regex 引擎
+    mask_cb = df["案件類別"].str.contains("轉換公司債", na=False, regex=False)
     cb_df = df[mask_cb].copy()
 
     if cb_df.empty:
@@ -174,7 +193,7 @@ def filter_conv_bond(df: pd.DataFrame, company_keyword: Optional[str] = None) ->
         if "公司名稱" not in cb_df.columns:
             raise KeyError("找不到『公司名稱』欄位，請檢查今日 Excel 格式是否有變化。")
 
-        mask_company = cb_df["公司名稱"].astype(str).str.contains(company_keyword, na=False)
+        mask_company = cb_df["公司名稱"].str.contains(company_keyword, na=False, regex=False)
         cb_df = cb_df[mask_company].copy()
 
         if cb_df.empty:
@@ -231,21 +250,156 @@ def generate_convbond_csv_for_today() -> Optional[Path]:
     return Path(out_name)
 
 
+# ========= 本地快取 =========
+
+CACHE_DIR = Path(".cache")
+
+# 已收盤的日 K（K 棒日期早於抓取日）不會再變，放 90 天
+# 最新價、抓取當天（可能還在盤中）的 K 只放 1 小時
+HIST_TTL = 90 * 24 * 3600
+LATEST_TTL = 3600
+
+
+class FileCache:
+    """JSON 檔快取：.cache/{代號}/{key}.json，另有一層程序內記憶體快取。"""
+
+    def __init__(self, root: Path = CACHE_DIR):
+        self.root = root
+        self._mem = {}
+
+    def _path(self, code, key):
+        return self.root / code / f"{key}.json"
+
+    def get(self, code, key, ttl):
+        """取快取（不存在或超過 ttl 秒回傳 None）"""
+        path = self._path(code, key)
+        entry = self._mem.get(path)
+        if entry is None:
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            self._mem[path] = entry
+
+        if time.time() - entry.get("ts", 0) > ttl:
+            return None
+        return entry
+
+    def set(self, code, key, **fields):
+        entry = {**fields, "ts": time.time()}
+        path = self._path(code, key)
+        self._mem[path] = entry
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(entry), encoding="utf-8")
+        except OSError as e:
+            print(f"[WARN] 寫入快取 {path} 失敗：{e}")
+
+    def delete(self, code, key):
+        path = self._path(code, key)
+        self._mem.pop(path, None)
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[WARN] 刪除快取 {path} 失敗：{e}")
+
+    def prune(self, max_age):
+        """刪掉超過 max_age 秒沒更新的 .cache/{代號}/*.json，空資料夾一併移除"""
+        cutoff = time.time() - max_age
+        for path in self.root.glob("*/*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    self._mem.pop(path, None)
+            except OSError as e:
+                print(f"[WARN] 清理快取 {path} 失敗：{e}")
+
+        for folder in self.root.glob("*/"):
+            try:
+                folder.rmdir()
+            except OSError:
+                pass  # 還有檔案
+
+
+# 金管會 Excel 的條件式 GET 索引：{url: {etag, last_modified, path}}
+FSC_INDEX_PATH = CACHE_DIR / "fsc_index.json"
+
+
+def download_with_etag(url: str) -> bytes:
+    """
+    條件式 GET 下載金管會 Excel：
+      - 帶上次的 ETag / Last-Modified，伺服器回 304 就直接讀 .cache/fsc_YYYYMMDD.xlsx
+      - 回 200 才覆蓋本地檔，並只保留最新一天的檔案
+    """
+    try:
+        index = json.loads(FSC_INDEX_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        index = {}
+
+    entry = index.get(url, {})
+    cached_path = Path(entry["path"]) if entry.get("path") else None
+
+    headers = {}
+    if cached_path is not None and cached_path.exists():
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = _SESSION.get(url, headers=headers, timeout=60)
+    if resp.status_code == 304 and headers:
+        print(f"[INFO] 檔案未更新（304），使用本地快取：{cached_path}")
+        return cached_path.read_bytes()
+    resp.raise_for_status()
+
+    content = resp.content
+    path = CACHE_DIR / f"fsc_{url.rsplit('/', 1)[-1][:8]}.xlsx"
+
+    # 舊日期的檔案用不到了，順手清掉
+    for old_url, old in list(index.items()):
+        if old_url != url:
+            Path(old["path"]).unlink(missing_ok=True)
+            del index[old_url]
+
+    index[url] = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "path": str(path),
+    }
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        FSC_INDEX_PATH.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+    except OSError as e:
+        print(f"[WARN] 寫入金管會 Excel 快取失敗：{e}")
+
+    return content
+
+
 # ========= 股價填入（原程式2） =========
 
-# 欄位設定
-COL_CODE = "A"
-COL_RECV_DATE = "E"
-COL_EFF_DATE = "F"
-COL_RECV_PRICE = "G"
-COL_EFF_PRICE = "H"
-COL_TODAY_PRICE = "I"
-COL_RECV_VOL = "J"
-COL_EFF_VOL = "K"
-COL_TODAY_VOL = "L"
+# 欄位設定（A / E / F 為輸入欄位，G~L 為補上的股價 / 張數）
+COL_CODE = "證券代號"
+COL_RECV_DATE = "收文日期"
+COL_EFF_DATE = "生效日期"
+COL_RECV_PRICE = "收文日期當天股價"
+COL_EFF_PRICE = "生效日期當天股價"
+COL_TODAY_PRICE = "今日股價"
+COL_RECV_VOL = "收文日期成交張數"
+COL_EFF_VOL = "生效日期成交張數"
+COL_TODAY_VOL = "今日成交張數"
 
-HEADER_ROW = 1
-START_ROW = 2
+# Yahoo 批次下載同時開的執行緒數（I/O bound，GIL 不影響；太多容易被 Yahoo 限流）
+YF_MAX_WORKERS = 8
+
+# 代號 → 上市 (.TW) / 上櫃 (.TWO)：只用來縮小下載清單、決定查價先試哪個
+# 查不到時仍會退回另一個交易所（可能轉上市 / 上櫃）
+_SUFFIX_CACHE: dict = {}
+
+# parse_date 用到的樣式，模組載入時編譯一次
+_ROC_RE = re.compile(r"^(\d{3})[./-](\d{1,2})[./-](\d{1,2})$")
+_DATE_FMTS = ("%Y-%m-%d", "%Y/%m/%d", "%y/%m/%d")
 
 
 def parse_date(cell_value):
@@ -260,83 +414,168 @@ def parse_date(cell_value):
 
     s = str(cell_value).strip()
 
-    # 民國年：1141021
+    # 民國年：1141021 / 西元年：20251021
     if s.isdigit():
-        if len(s) == 7:
-            try:
-                y = int(s[:3]) + 1911
-                m = int(s[3:5])
-                d = int(s[5:7])
-                return dt.date(y, m, d)
-            except:
-                pass
-        if len(s) == 8:
-            try:
+        try:
+            if len(s) == 7:
+                return dt.date(int(s[:3]) + 1911, int(s[3:5]), int(s[5:7]))
+            if len(s) == 8:
                 return dt.datetime.strptime(s, "%Y%m%d").date()
-            except:
-                pass
+        except ValueError:
+            pass
 
     # 民國有符號
-    roc = re.match(r"^(\d{3})[./-](\d{1,2})[./-](\d{1,2})$", s)
+    roc = _ROC_RE.match(s)
     if roc:
         try:
             y = int(roc.group(1)) + 1911
             m = int(roc.group(2))
             d = int(roc.group(3))
             return dt.date(y, m, d)
-        except:
+        except ValueError:
+            pass
+
+    # 西元 YYYY-MM-DD：fromisoformat 是 C 實作，比 strptime 快很多
+    if len(s) == 10 and s[4] == "-":
+        try:
+            return dt.date.fromisoformat(s)
+        except ValueError:
             pass
 
     # 常見西元格式
-    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%y/%m/%d"):
+    for fmt in _DATE_FMTS:
         try:
             return dt.datetime.strptime(s, fmt).date()
-        except:
+        except ValueError:
             continue
 
     return None
 
 
-def get_yahoo_ohlcv_by_date(ticker, date):
-    """抓指定日期 OHLCV（只有 1 根 K）"""
-    if date is None:
-        return None, None
+def parse_date_series(values: pd.Series) -> pd.Series:
+    """
+    整欄版 parse_date：
+      - 7 碼民國年（1141021）直接用整數運算換算
+      - 完整的 YYYY-MM-DD[ 時間] 交給 pd.to_datetime 一次處理
+        （"2025"、"2025-10" 這種不完整日期不走這條，免得補出不存在的日子）
+      - 剩下少數格式（114/10/21、2025/10/21…）才逐格丟給 parse_date
+    回傳 datetime64 的 Series（無法解析為 NaT）
+    """
+    s = values.astype("string").str.strip()
+    # CSV 讀成浮點數時會變成 1141021.0
+    s = s.str.replace(r"\.0$", "", regex=True)
+
+    out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+
+    roc = s.str.fullmatch(r"\d{7}").fillna(False).astype(bool)
+    if roc.any():
+        n = s[roc].astype(int)
+        ymd = (n // 10000 + 1911) * 10000 + n % 10000
+        out[roc] = pd.to_datetime(ymd.astype(str), format="%Y%m%d", errors="coerce")
+
+    rest = ~roc & s.notna() & (s != "")
+
+    iso = rest & s.str.match(r"^\d{4}-\d{2}-\d{2}(?:[ T]|$)").fillna(False).astype(bool)
+    if iso.any():
+        out[iso] = pd.to_datetime(s[iso], format="ISO8601", errors="coerce").dt.normalize()
+
+    left = rest & out.isna()
+    if left.any():
+        out[left] = pd.to_datetime(s[left].map(parse_date), errors="coerce")
+
+    return out
+
+
+def _download_bars(tickers, start: dt.date, end: dt.date) -> dict:
+    """批次下載 tickers，回傳 {ticker: DataFrame[Close, Volume]}，只保留有資料的 ticker"""
+    if not tickers:
+        return {}
 
     try:
-        df = yf.download(
-            ticker,
-            start=date,
-            end=date + dt.timedelta(days=1),
-            progress=False,
-            auto_adjust=False
+        bulk = yf.download(
+            tickers,
+            start=start,
+            end=end,
+            group_by="ticker",
+            threads=YF_MAX_WORKERS,
+            auto_adjust=False,
+            progress=False
         )
     except Exception as e:
-        print(f"[WARN] 下載 {ticker} {date} 失敗：{e}")
+        print(f"[WARN] 批次下載 {len(tickers)} 檔失敗：{e}")
+        return {}
+
+    if bulk.empty:
+        return {}
+    if not isinstance(bulk.columns, pd.MultiIndex):
+        # 只抓一檔時，舊版 yfinance 回傳的不是 MultiIndex
+        bulk = pd.concat({tickers[0]: bulk}, axis=1)
+
+    # MultiIndex 只拆一次，之後每次查價都是 dict 取值
+    available = set(bulk.columns.get_level_values(0))
+    bars = {}
+    for ticker in tickers:
+        if ticker not in available:
+            continue
+        df = bulk[ticker][["Close", "Volume"]].dropna(subset=["Close"])
+        if not df.empty:
+            bars[ticker] = df
+    return bars
+
+
+def download_tw_bulk(codes, start: dt.date, end: dt.date) -> dict:
+    """
+    一次抓所有代號（.TW / .TWO）在 [start, end) 區間的日 K
+    已知上市 / 上櫃的代號只抓對應的 ticker，其餘兩個都抓
+    已知的 ticker 抓不到資料（可能轉上市 / 上櫃）就忘掉它，兩個都重抓一次
+    回傳 {ticker: DataFrame[Close, Volume]}，只保留有資料的 ticker
+    """
+    known = [c for c in codes if c in _SUFFIX_CACHE]
+    tickers = [t for c in codes for t in _download_tickers(c)]
+    bars = _download_bars(tickers, start, end)
+
+    stale = [c for c in known if c + _SUFFIX_CACHE[c] not in bars]
+    if stale:
+        print(f"[INFO] {len(stale)} 檔已知交易所抓不到資料，改為 TW / TWO 都重抓：{stale}")
+        for c in stale:
+            del _SUFFIX_CACHE[c]
+        retry = [t for c in stale for t in _download_tickers(c)]
+        bars.update(_download_bars(retry, start, end))
+        tickers += retry
+
+    # bulk.columns 的順序跟著執行緒完成先後，不可靠；照 tickers（先 TW 再 TWO）決定
+    resolved = {}
+    for ticker in tickers:
+        if ticker in bars:
+            code, suffix = ticker.rsplit(".", 1)
+            resolved.setdefault(code, "." + suffix)
+
+    _SUFFIX_CACHE.update(resolved)
+    return bars
+
+
+def get_yahoo_ohlcv_by_date(bars, ticker, date):
+    """取指定日期 OHLCV（只有 1 根 K）"""
+    if date is None:
         return None, None
 
-    if df.empty:
+    df = bars.get(ticker)
+    if df is None:
         return None, None
 
-    close = float(df["Close"].iloc[0])
-    volume = float(df["Volume"].iloc[0])
-    return close, volume
+    ts = pd.Timestamp(date)
+    if ts not in df.index:
+        return None, None
 
+    close = float(df.at[ts, "Close"])
+    volume = float(df.at[ts, "Volume"])
+    return close, volume
 
-def get_yahoo_latest_ohlcv(ticker):
-    """抓最近一個交易日 OHLCV（最新股價）"""
-    try:
-        df = yf.download(
-            ticker,
-            period="5d",
-            interval="1d",
-            progress=False,
-            auto_adjust=False
-        )
-    except Exception as e:
-        print(f"[WARN] 下載最新 {ticker} 失敗：{e}")
-        return None, None
 
-    if df.empty:
+def get_yahoo_latest_ohlcv(bars, ticker):
+    """取最近一個交易日 OHLCV（最新股價）"""
+    df = bars.get(ticker)
+    if df is None:
         return None, None
 
     close = float(df["Close"].iloc[-1])
@@ -344,33 +583,128 @@ def get_yahoo_latest_ohlcv(ticker):
     return close, volume
 
 
-def get_tw_ohlcv_by_date(code, date):
+def _download_tickers(code):
+    """要下載的 ticker：已知交易所就只抓一個，否則先 TW 再 TWO 都抓"""
+    suffix = _SUFFIX_CACHE.get(code)
+    if suffix:
+        return [code + suffix]
+    return [code + ".TW", code + ".TWO"]
+
+
+def _tw_tickers(code):
+    """查價順序：已知交易所的 ticker 先試，另一個當備援；未知就先 TW 再 TWO"""
+    if _SUFFIX_CACHE.get(code) == ".TWO":
+        return [code + ".TWO", code + ".TW"]
+    return [code + ".TW", code + ".TWO"]
+
+
+def get_tw_ohlcv_by_date(bars, code, date):
     """台股（先 TW 再 TWO）"""
     if date is None:
         return None, None
 
-    code = str(code).strip()
+    for ticker in _tw_tickers(code):
+        close, vol = get_yahoo_ohlcv_by_date(bars, ticker, date)
+        if close is not None:
+            return close, vol
+    return None, None
 
-    close, vol = get_yahoo_ohlcv_by_date(code + ".TW", date)
-    if close is not None:
-        return close, vol
 
-    close, vol = get_yahoo_ohlcv_by_date(code + ".TWO", date)
-    return close, vol
+def get_tw_latest_ohlcv(bars, code):
+    for ticker in _tw_tickers(code):
+        close, vol = get_yahoo_latest_ohlcv(bars, ticker)
+        if close is not None:
+            return close, vol
+    return None, None
 
 
-def get_tw_latest_ohlcv(code, cache):
-    code = str(code).strip()
+def fetch_tw_quotes(code_dates, today: dt.date):
+    """
+    依 {代號: {日期, ...}} 取得收盤價 / 成交量：
+      - 先查本地快取，只把缺的代號丟去批次下載
+      - 回傳 {(代號, 日期): (close, vol)}，以及 {(代號, "latest"): (close, vol)}
+    """
+    cache = FileCache()
+    quotes = {}
+    missing = {}
+    persisted = {}
+
+    for code, dates in code_dates.items():
+        # 上次執行已確認的上市 / 上櫃別，這次只抓那一個 ticker
+        hit = cache.get(code, "suffix", HIST_TTL)
+        if hit is not None:
+            persisted[code] = hit["suffix"]
+            _SUFFIX_CACHE.setdefault(code, hit["suffix"])
+
+        for key in list(dates) + ["latest"]:
+            # TTL 看寫入時是否已收盤（final），不是看 K 棒現在離今天多久
+            hit = cache.get(code, str(key), HIST_TTL)
+            if hit is not None and not hit.get("final"):
+                hit = cache.get(code, str(key), LATEST_TTL)
+
+            if hit is not None:
+                quotes[(code, key)] = (hit["close"], hit["volume"])
+            else:
+                missing.setdefault(code, []).append(key)
+
+    if not missing:
+        print("[INFO] 股價全部命中本地快取，略過下載。")
+        return quotes
+
+    # 起點取最早的缺漏日期，且至少往前抓一週，確保「今日（最新）」有 K 棒
+    dates = [k for keys in missing.values() for k in keys if k != "latest"]
+    start = min(dates + [today - dt.timedelta(days=7)])
+    bars = download_tw_bulk(sorted(missing), start, today + dt.timedelta(days=1))
+
+    for code, keys in missing.items():
+        for key in keys:
+            if key == "latest":
+                close, vol = get_tw_latest_ohlcv(bars, code)
+            else:
+                close, vol = get_tw_ohlcv_by_date(bars, code, key)
+
+            quotes[(code, key)] = (close, vol)
+            if close is not None:
+                # 抓取當天的 K 可能是盤中的部分價量，不能當成定案
+                final = key != "latest" and key < today
+                cache.set(code, str(key), close=close, volume=vol, final=final)
+
+        # 只在交易所別有變時才寫，TTL 到期就會重新兩個都確認一次
+        suffix = _SUFFIX_CACHE.get(code)
+        if suffix != persisted.get(code):
+            if suffix:
+                cache.set(code, "suffix", suffix=suffix)
+            else:
+                cache.delete(code, "suffix")
+
+    # 順手清掉過期的快取，避免 actions/cache 每次執行都越存越大
+    cache.prune(HIST_TTL)
+
+    return quotes
+
+
+def write_xlsx(df: pd.DataFrame, path: Path, sheet_name: str = "Sheet1", header_styles=None):
+    """
+    用 xlsxwriter 直接把 DataFrame 一列一列 write_row 寫出（constant_memory 模式）
+    header_styles：{欄名: add_format 參數}，沒列到的標題沿用 pandas to_excel 的樣式
+    """
+    header_styles = header_styles or {}
+
+    book = xlsxwriter.Workbook(str(path), {"constant_memory": True, "default_date_format": "yyyy-mm-dd"})
+    ws = book.add_worksheet(sheet_name)
 
-    if code in cache:
-        return cache[code]
+    # 跟 pandas to_excel 預設標題一樣：粗體、細框線、水平置中、垂直靠上
+    default_fmt = book.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    for c, name in enumerate(df.columns):
+        props = header_styles.get(name)
+        ws.write(0, c, name, book.add_format(props) if props else default_fmt)
 
-    close, vol = get_yahoo_latest_ohlcv(code + ".TW")
-    if close is None:
-        close, vol = get_yahoo_latest_ohlcv(code + ".TWO")
+    # NaN / NA 換成 None，xlsxwriter 會寫成空白格
+    values = df.astype(object).where(df.notna(), None)
+    for r, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        ws.write_row(r, 0, row)
 
-    cache[code] = (close, vol)
-    return close, vol
+    book.close()
 
 
 def fill_prices_for_file(csv_path: Path):
@@ -379,130 +713,115 @@ def fill_prices_for_file(csv_path: Path):
       - 讀取 fsc_convbond_YYYYMMDD.csv （或 .xlsx）
       - 依收文 / 生效 / 今日，補上股價 + 成交量
       - 輸出 *_with_price.xlsx 與 *_last20.xlsx
-    回傳：(with_price_path, last20_path, n_rows)
+    回傳：(with_price_path, last20_path, last20_df, n_rows)
     """
     original_path = csv_path
 
-    # 允許 .csv 或 .xlsx
+    # 允許 .csv 或 .xlsx，直接讀進 DataFrame，不再先轉存 xlsx 再用 openpyxl 讀回
     if original_path.suffix.lower() == ".csv":
-        df = pd.read_csv(original_path)
-        xlsx_path = original_path.with_suffix(".xlsx")
-        df.to_excel(xlsx_path, index=False)
+        df = pd.read_csv(original_path, dtype={COL_CODE: str})
     else:
-        xlsx_path = original_path
-
-    wb = openpyxl.load_workbook(xlsx_path)
-    ws = wb[wb.sheetnames[0]]
+        df = pd.read_excel(original_path, engine="calamine", dtype={COL_CODE: str})
 
     today = dt.date.today()
 
-    def normalize_date(d):
-        if d is None:
-            return None
-        if d.year < 1990 or d > today:
-            return None
-        return d
-
-    # 標題列設定
-    def set_header(cell, text, bold=True, color=None, bg=None):
-        cell.value = text
-        cell.alignment = Alignment(horizontal="center")
-        if bold:
-            cell.font = Font(bold=True, color=color if color else "000000")
-        if bg:
-            cell.fill = PatternFill("solid", fgColor=bg)
+    def normalize_dates(dates: pd.Series) -> pd.Series:
+        """整欄遮掉 1990 年以前或晚於今天的日期，轉成 datetime.date（無效為 None）"""
+        dates = dates.mask((dates.dt.year < 1990) | (dates > pd.Timestamp(today)))
+        return dates.dt.date.where(dates.notna(), None).astype(object)
 
-    set_header(ws[f"{COL_RECV_PRICE}1"], "收文日期當天股價", True, "FFFFFF", "0000FF")
-    set_header(ws[f"{COL_EFF_PRICE}1"], "生效日期當天股價", True, "000000", "FFFF00")
-    set_header(ws[f"{COL_TODAY_PRICE}1"], "今日股價", True, "FFFFFF", "000000")
+    # ===== 日期整欄解析 + 過濾，再收集代號與日期 =====
+    recv_dates = normalize_dates(parse_date_series(df[COL_RECV_DATE]))
+    eff_dates = normalize_dates(parse_date_series(df[COL_EFF_DATE]))
 
-    set_header(ws[f"{COL_RECV_VOL}1"], "收文日期成交張數")
-    set_header(ws[f"{COL_EFF_VOL}1"], "生效日期成交張數")
-    set_header(ws[f"{COL_TODAY_VOL}1"], "今日成交張數")
+    # 證券代號只在這裡整理一次（字串 + 去空白），之後查價直接用
+    codes = df[COL_CODE].astype("string").str.strip()
 
-    # 最新資料 cache
-    latest_cache = {}
+    tasks = []
+    for i, (code, recv_date, eff_date) in enumerate(zip(codes, recv_dates, eff_dates)):
+        if pd.isna(code) or code == "":
+            break
 
-    # ===== 逐列處理 =====
-    row = START_ROW
+        tasks.append((i, code, recv_date, eff_date))
 
-    while True:
-        code = ws[f"{COL_CODE}{row}"].value
-        if code is None or str(code).strip() == "":
-            break
+    # ===== 取股價（本地快取 + 批次下載）=====
+    code_dates = {}
+    for _, code, recv_date, eff_date in tasks:
+        dates = code_dates.setdefault(code, set())
+        dates.update(d for d in (recv_date, eff_date) if d is not None)
 
-        recv_raw = ws[f"{COL_RECV_DATE}{row}"].value
-        eff_raw = ws[f"{COL_EFF_DATE}{row}"].value
+    quotes = fetch_tw_quotes(code_dates, today)
 
-        recv_date = normalize_date(parse_date(recv_raw))
-        eff_date = normalize_date(parse_date(eff_raw))
+    # ===== 逐列算出結果，最後整欄寫回 DataFrame =====
+    n = len(df)
+    recv_px, eff_px, today_px = [None] * n, [None] * n, [None] * n
+    recv_lots, eff_lots, today_lots = [None] * n, [None] * n, [None] * n
 
+    for i, code, recv_date, eff_date in tasks:
         # 收文
-        recv_close, recv_vol_sh = get_tw_ohlcv_by_date(code, recv_date)
-        recv_lots = round(recv_vol_sh / 1000) if recv_vol_sh else None
-        ws[f"{COL_RECV_PRICE}{row}"].value = recv_close
-        ws[f"{COL_RECV_VOL}{row}"].value = recv_lots
+        recv_close, recv_vol_sh = quotes.get((code, recv_date), (None, None))
+        recv_px[i] = recv_close
+        recv_lots[i] = round(recv_vol_sh / 1000) if recv_vol_sh else None
 
         # 生效
-        eff_close, eff_vol_sh = get_tw_ohlcv_by_date(code, eff_date)
-        eff_lots = round(eff_vol_sh / 1000) if eff_vol_sh else None
-        ws[f"{COL_EFF_PRICE}{row}"].value = eff_close
-        ws[f"{COL_EFF_VOL}{row}"].value = eff_lots
+        eff_close, eff_vol_sh = quotes.get((code, eff_date), (None, None))
+        eff_px[i] = eff_close
+        eff_lots[i] = round(eff_vol_sh / 1000) if eff_vol_sh else None
 
         # 今日（最新）
-        today_close, today_vol_sh = get_tw_latest_ohlcv(code, latest_cache)
-        today_lots = round(today_vol_sh / 1000) if today_vol_sh else None
-        ws[f"{COL_TODAY_PRICE}{row}"].value = today_close
-        ws[f"{COL_TODAY_VOL}{row}"].value = today_lots
+        today_close, today_vol_sh = quotes[(code, "latest")]
+        today_px[i] = today_close
+        today_lots[i] = round(today_vol_sh / 1000) if today_vol_sh else None
 
-        row += 1
+    df[COL_RECV_PRICE] = recv_px
+    df[COL_EFF_PRICE] = eff_px
+    df[COL_TODAY_PRICE] = today_px
+    df[COL_RECV_VOL] = recv_lots
+    df[COL_EFF_VOL] = eff_lots
+    df[COL_TODAY_VOL] = today_lots
 
     # 實際資料列數（不含標題）
-    n_rows = (row - START_ROW) if row > START_ROW else 0
+    n_rows = len(tasks)
 
     # ===== 存檔（避免檔案占用）=====
-    base = xlsx_path.stem + "_with_price"
-    out_path = xlsx_path.with_name(base + ".xlsx")
+    base = original_path.stem + "_with_price"
+    out_path = original_path.with_name(base + ".xlsx")
+
+    # 標題列設定
+    def header_style(color="#000000", bg=None):
+        props = {"bold": True, "font_color": color, "align": "center"}
+        if bg:
+            props.update(pattern=1, bg_color=bg)
+        return props
+
+    header_styles = {
+        COL_RECV_PRICE: header_style("#FFFFFF", "#0000FF"),
+        COL_EFF_PRICE: header_style("#000000", "#FFFF00"),
+        COL_TODAY_PRICE: header_style("#FFFFFF", "#000000"),
+        COL_RECV_VOL: header_style(),
+        COL_EFF_VOL: header_style(),
+        COL_TODAY_VOL: header_style(),
+    }
 
     idx = 1
     while True:
         try:
-            wb.save(out_path)
+            write_xlsx(df, out_path, header_styles=header_styles)
             break
-        except PermissionError:
-            out_path = xlsx_path.with_name(f"{base}_{idx}.xlsx")
+        except FileCreateError:
+            out_path = original_path.with_name(f"{base}_{idx}.xlsx")
             idx += 1
 
     print(f"✔ 全資料已輸出：{out_path}")
 
-    # ===== 產生最後 20 筆 =====
-    wb2 = openpyxl.load_workbook(out_path)
-    ws2 = wb2[wb2.sheetnames[0]]
-
-    last_row = ws2.max_row
-    start_last20 = max(START_ROW, last_row - 19)
-
-    wb_last20 = Workbook()
-    ws_last20 = wb_last20.active
-    ws_last20.title = "last20"
-
-    # 複製標題
-    for col in range(1, ws2.max_column + 1):
-        ws_last20.cell(row=1, column=col).value = ws2.cell(row=1, column=col).value
-
-    # 複製最後 20 列
-    to_row = 2
-    for r in range(start_last20, last_row + 1):
-        for c in range(1, ws2.max_column + 1):
-            ws_last20.cell(row=to_row, column=c).value = ws2.cell(row=r, column=c).value
-        to_row += 1
-
-    last20_path = out_path.with_name(xlsx_path.stem + "_last20.xlsx")
-    wb_last20.save(last20_path)
+    # ===== 產生最後 20 筆（直接從記憶體切，不重讀剛存的檔）=====
+    last20_df = df.tail(20)
+    last20_path = out_path.with_name(original_path.stem + "_last20.xlsx")
+    write_xlsx(last20_df, last20_path, sheet_name="last20")
 
     print(f"✔ 最後 20 筆已另存：{last20_path}")
 
-    return out_path, last20_path, n_rows
+    return out_path, last20_path, last20_df, n_rows
 
 
 # ========= LINE 訊息內容組裝 =========
@@ -519,28 +838,23 @@ def build_text_summary(today: dt.date, n_rows: int) -> str:
     return msg
 
 
-def build_flex_carousels_from_last20(last20_path: Path):
+def build_flex_carousels_from_last20(df: pd.DataFrame):
     """
-    讀取 last20.xlsx → 產生 Flex Message Carousel list
+    最後 20 筆（記憶體中的 DataFrame，不重讀 last20.xlsx）→ 產生 Flex Message Carousel list
     LINE 限制：一個 carousel 最多 10 個 bubble
     所以 20 筆會拆成 2 個 carousel
     """
-    try:
-        df = pd.read_excel(last20_path)
-    except Exception as e:
-        print(f"[WARN] 讀取 last20 excel 失敗：{e}")
-        return []
-
     bubbles = []
 
-    for _, row in df.iterrows():
-        code = str(row.get("證券代號", ""))
-        name = str(row.get("公司名稱", ""))
-        recv = str(row.get("收文日期", ""))
-        eff = str(row.get("生效日期", ""))
-        recv_px = str(row.get("收文日期當天股價", ""))
-        eff_px = str(row.get("生效日期當天股價", ""))
-        today_px = str(row.get("今日股價", ""))
+    # itertuples 不用每列建一個 Series，比 iterrows 快；中文欄名本身就是合法屬性名
+    for row in df.itertuples(index=False):
+        code = str(getattr(row, COL_CODE, ""))
+        name = str(getattr(row, "公司名稱", ""))
+        recv = str(getattr(row, COL_RECV_DATE, ""))
+        eff = str(getattr(row, COL_EFF_DATE, ""))
+        recv_px = str(getattr(row, COL_RECV_PRICE, ""))
+        eff_px = str(getattr(row, COL_EFF_PRICE, ""))
+        today_px = str(getattr(row, COL_TODAY_PRICE, ""))
 
         bubble = {
             "type": "bubble",
@@ -605,9 +919,9 @@ def build_flex_carousels_from_last20(last20_path: Path):
     return carousels
 
 
-def send_flex_last20(last20_path: Path, today: dt.date, n_rows: int):
-    """從 last20 檔案產生 Flex，並分批推播。"""
-    carousels = build_flex_carousels_from_last20(last20_path)
+def send_flex_last20(last20_df: pd.DataFrame, today: dt.date, n_rows: int):
+    """從最後 20 筆資料產生 Flex，並分批推播。"""
+    carousels = build_flex_carousels_from_last20(last20_df)
     if not carousels:
         send_line_message("⚠ 轉換公司債最後 20 筆 Flex 生成失敗，請稍後檢查程式。")
         return
@@ -636,10 +950,10 @@ def main():
         return
 
     # 2) 接著執行「程式2」：讀取 CSV，補股價 & 成交量，輸出 with_price / last20
-    with_price_path, last20_path, n_rows = fill_prices_for_file(csv_path)
+    with_price_path, last20_path, last20_df, n_rows = fill_prices_for_file(csv_path)
 
     # 3) 用 Flex Message 呈現最後 20 筆
-    send_flex_last20(last20_path, today, n_rows)
+    send_flex_last20(last20_df, today, n_rows)
 
 
 if __name__ == "__main__":